@@ -2,26 +2,67 @@
 # -------------------------------
 # Connecting to backend
 # -------------------------------
+import gzip
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import streamlit as st
+import numpy as np
 import pandas as pd
 
+try:
+    import orjson  # optional: faster JSON encode/decode for /v1/run
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack  # optional: binary /v1/run requests and responses
+except ImportError:
+    msgpack = None
+
 st.set_page_config(page_title="Country & Transport Inputs", page_icon="🌍", layout="wide")
 
 API_URL   = st.secrets.get("API_URL")   or os.getenv("API_URL")   or "http://127.0.0.1:8000"
 API_TOKEN = st.secrets.get("API_TOKEN") or os.getenv("API_TOKEN") or ""
+# Gzip large /v1/run bodies; only enable once the backend accepts Content-Encoding: gzip
+API_COMPRESS = str(st.secrets.get("API_COMPRESS") or os.getenv("API_COMPRESS") or "").lower() in ("1", "true", "yes")
+COMPRESS_MIN_BYTES = 1024
+# /v1/run request body format: "json" (default) or "msgpack" (needs msgpack and backend support)
+API_FORMAT = str(st.secrets.get("API_FORMAT") or os.getenv("API_FORMAT") or "json").lower()
 
 st.caption(f"Backend: {API_URL}")
+if API_FORMAT == "msgpack" and msgpack is None:
+    st.warning("API_FORMAT is 'msgpack' but the msgpack package is not installed; sending JSON instead.")
 
 # -------------------------------
 # Backend helpers
 # -------------------------------
+@st.cache_resource
+def get_session() -> requests.Session:
+    """
+    One pooled HTTP session shared across reruns, so repeated button clicks
+    reuse the open TCP/TLS connection to the backend instead of reconnecting.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        max_retries=Retry(total=3, backoff_factor=0.2),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if API_TOKEN:
+        session.headers["Authorization"] = f"Bearer {API_TOKEN}"
+    return session
+
 def call_backend_hello() -> str:
     """
     Call the simplified backend GET /v1/hello which returns plain text.
     """
-    r = requests.get(f"{API_URL}/v1/hello", timeout=15)
+    r = get_session().get(f"{API_URL}/v1/hello", timeout=15)
     r.raise_for_status()
     # The backend uses PlainTextResponse; r.text is the raw string.
     return r.text.strip()
@@ -30,7 +71,7 @@ def call_backend_ping() -> str:
     """
     Call simplified backend GET /v1/ping which returns 'pong'.
     """
-    r = requests.get(f"{API_URL}/v1/ping", timeout=15)
+    r = get_session().get(f"{API_URL}/v1/ping", timeout=15)
     r.raise_for_status()
     return r.text.strip()
 
@@ -38,21 +79,103 @@ def call_backend_root() -> str:
     """
     Call simplified backend GET / which returns 'Backend is alive'.
     """
-    r = requests.get(f"{API_URL}/", timeout=15)
+    r = get_session().get(f"{API_URL}/", timeout=15)
     r.raise_for_status()
     return r.text.strip()
 
+HEALTH_CHECKS = {
+    "GET /": "/",
+    "GET /v1/ping": "/v1/ping",
+    "GET /v1/hello": "/v1/hello",
+}
+
+def call_backend_health_checks() -> dict:
+    """
+    Fire all simple GET endpoints concurrently over the shared session.
+    Wall time is the slowest call rather than the sum of all three.
+    Returns {label: response text or the exception raised}.
+    """
+    # Resolve the cached session here, in the script thread: the worker threads
+    # have no ScriptRunContext for st.cache_resource to run in.
+    session = get_session()
+
+    def run(path: str):
+        try:
+            r = session.get(f"{API_URL}{path}", timeout=15)
+            r.raise_for_status()
+            return r.text.strip()
+        except requests.RequestException as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=len(HEALTH_CHECKS)) as pool:
+        results = pool.map(run, HEALTH_CHECKS.values())
+        return dict(zip(HEALTH_CHECKS, results))
+
+def dumps_json(payload) -> bytes:
+    """
+    Serialize a payload to JSON bytes, using orjson when it is installed.
+    Year keys are ints, hence OPT_NON_STR_KEYS (stdlib json stringifies them too).
+    NaN/inf are refused (ValueError) like requests' json= did: orjson would
+    silently send them as null, so the builders reject non-finite values first.
+    """
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, allow_nan=False).encode("utf-8")
+
+def loads_json(content: bytes):
+    """
+    Parse JSON bytes; both orjson and stdlib errors are ValueError subclasses.
+    """
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+def ndarray_hook(obj: dict):
+    """
+    msgpack object_hook: rebuild numpy arrays sent as
+    {"__ndarray__": True, "dtype": ..., "shape": [...], "data": <bytes>}.
+    """
+    if obj.get("__ndarray__") is True:
+        return np.frombuffer(obj["data"], dtype=obj["dtype"]).reshape(obj["shape"])
+    return obj
+
+def str_keys(obj):
+    """
+    Recursively stringify dict keys, so msgpack sends the same schema as
+    JSON (where the int year keys become "2020", ...).
+    """
+    if isinstance(obj, dict):
+        return {str(k): str_keys(v) for k, v in obj.items()}
+    return obj
+
 def call_backend_legacy_run(payload: dict):
     """
-    Legacy POST to /v1/run that expects JSON and optional Bearer token.
+    Legacy POST to /v1/run that expects JSON and optional Bearer token
+    (the token is set once on the shared session). Bodies above
+    COMPRESS_MIN_BYTES are gzipped when API_COMPRESS is enabled. If msgpack is
+    installed the body is sent as MessagePack when API_FORMAT="msgpack", and
+    the backend may answer in MessagePack instead of JSON.
     Keep this for when you switch your backend back to the model endpoint.
     """
-    headers = {"Authorization": f"Bearer {API_TOKEN}"} if API_TOKEN else {}
-    r = requests.post(f"{API_URL}/v1/run", json=payload, headers=headers, timeout=30)
+    if API_FORMAT == "msgpack" and msgpack is not None:
+        body = msgpack.packb(str_keys(payload), use_bin_type=True)
+        headers = {"Content-Type": "application/msgpack"}
+    else:
+        body = dumps_json(payload)
+        headers = {"Content-Type": "application/json"}
+    if msgpack is not None:
+        headers["Accept"] = "application/msgpack, application/json;q=0.5"
+    if API_COMPRESS and len(body) > COMPRESS_MIN_BYTES:
+        body = gzip.compress(body)
+        headers["Content-Encoding"] = "gzip"
+    r = get_session().post(f"{API_URL}/v1/run", data=body, headers=headers, timeout=30)
     r.raise_for_status()
+    if msgpack is not None and r.headers.get("Content-Type", "").startswith("application/msgpack"):
+        # Year keys are ints, which strict_map_key would reject
+        return msgpack.unpackb(r.content, raw=False, strict_map_key=False, object_hook=ndarray_hook)
     # Try JSON first, fall back to text if backend returns a plain string by mistake
     try:
-        return r.json()
+        return loads_json(r.content)
     except ValueError:
         return {"raw_text": r.text}
 
@@ -60,26 +183,47 @@ def call_backend_legacy_run(payload: dict):
 # --------------------------------
 # Config
 # --------------------------------
-YEARS = list(range(2020, 2051, 5))
-FUEL_ROWS = ["Gasoline (%)", "Diesel (%)", "Electric (%)", "Biofuel (%)", "Total (%)"]
+COUNTRIES = (
+    "Australia", "China", "EU-27", "United States",
+    "India", "Japan", "Brazil", "South Africa",
+)
+YEARS = tuple(range(2020, 2051, 5))
+YEAR_STRS = tuple(str(y) for y in YEARS)
+IDX_2050 = YEARS.index(2050)
+FUEL_ROWS = ("Gasoline (%)", "Diesel (%)", "Electric (%)", "Biofuel (%)", "Total (%)")
+# Fuel columns sent in the payload (not 'Total (%)') and their payload keys
+FUEL_COLS = tuple(c for c in FUEL_ROWS if c.strip().lower() not in ("total (%)", "total"))
+FUEL_KEYS = tuple(c.lower().replace("(%)", "").strip() for c in FUEL_COLS)
+
+# data_editor column configs: the script top level re-runs on every interaction,
+# so cache_resource is what keeps these from being rebuilt each time
+@st.cache_resource(show_spinner=False)
+def _km_col_config() -> dict:
+    return {
+        ys: st.column_config.NumberColumn(ys, min_value=0.0, max_value=10000.0, step=1.0)
+        for ys in YEAR_STRS
+    }
+
+@st.cache_resource(show_spinner=False)
+def _fuel_col_config() -> dict:
+    return {
+        ys: st.column_config.NumberColumn(ys, min_value=0.0, max_value=100.0, step=0.1)
+        for ys in YEAR_STRS
+    }
 
 # --------------------------------
 # Defaults & utils
 # --------------------------------
 def default_transport_df():
     """
-    Internally store transport fuel shares as years x fuel (rows=index=Year; columns=fuel).
-    Defaults sum to 100 across all years.
+    Internally store transport fuel shares as fuel x years (rows=index=fuel; columns=Year),
+    the same orientation the fuel-mix editor shows. Defaults sum to 100 across all years.
     """
-    base = {
-        "Gasoline (%)": 30.0,
-        "Diesel (%)": 40.0,
-        "Electric (%)": 20.0,
-        "Biofuel (%)": 10.0,
-        "Total (%)": 100.0,
-    }
-    df = pd.DataFrame([base.copy() for _ in YEARS], index=YEARS)
-    df.index.name = "Year"
+    # Same order as FUEL_ROWS: gasoline, diesel, electric, biofuel, total
+    base = np.array([30.0, 40.0, 20.0, 10.0, 100.0], dtype=np.float64)
+    arr = np.broadcast_to(base[:, None], (len(FUEL_ROWS), len(YEARS))).copy()
+    df = pd.DataFrame(arr, index=FUEL_ROWS, columns=YEARS)
+    df.columns.name = "Year"
     return df
 
 def default_transport_km_wide():
@@ -87,49 +231,91 @@ def default_transport_km_wide():
     Transport activity (as % of 2020) in a wide 1xN table with years as columns.
     Defaults 100 for all years, 120 for 2050.
     """
-    vals = {y: 100.0 for y in YEARS}
-    vals[2050] = 120.0
-    km_df = pd.DataFrame([vals], index=["Transport km (% of 2020)"])
+    arr = np.full((1, len(YEARS)), 100.0, dtype=np.float64)
+    arr[0, IDX_2050] = 120.0
+    km_df = pd.DataFrame(arr, index=["Transport km (% of 2020)"], columns=YEARS)
     return km_df
 
 def init_state():
+    """
+    Seed missing session_state keys. Callables are factories and are only
+    invoked for keys that are not set yet, so reruns don't rebuild frames.
+    """
     defaults = {
         # Main
         "country": "Australia",
         "scenario": "Business-as-usual",
         "carbon_budget": "1.5 °C",
         # Transport data
-        "transport_df": default_transport_df(),            # years (rows) × fuels (cols)
-        "transport_km_wide": default_transport_km_wide(),  # 1 row × YEARS cols
+        "transport_df": default_transport_df,            # fuels (rows) × years (cols)
+        "transport_km_wide": default_transport_km_wide,  # 1 row × YEARS cols
     }
     for k, v in defaults.items():
-        st.session_state.setdefault(k, v)
+        if k not in st.session_state:
+            st.session_state[k] = v() if callable(v) else v
+
+    # Keep stored frames in canonical order so display code needn't reindex
+    df = st.session_state["transport_df"]
+    if tuple(df.index) == YEARS and tuple(df.columns) == FUEL_ROWS:
+        # Session from before the fuels×years layout: transpose, don't reindex to NaN
+        df = df.T
+        st.session_state["transport_df"] = df
+    if tuple(df.index) != FUEL_ROWS or tuple(df.columns) != YEARS:
+        st.session_state["transport_df"] = df.reindex(index=FUEL_ROWS, columns=YEARS)
+    km = st.session_state["transport_km_wide"]
+    if tuple(km.columns) != YEARS:
+        st.session_state["transport_km_wide"] = km.reindex(columns=YEARS)
 
 # --------------------------------
 # Builders for legacy payload
+# (cached on the frames' contents: re-running with unchanged tables reuses them;
+# the cache is shared by all sessions, so keep it small)
 # --------------------------------
-def build_transport_fuel_share(df_years_fuels: pd.DataFrame) -> dict:
-    """
-    Convert years×fuels (% columns) into {year: {fuel_key: float}}
-    Drops the 'Total (%)' column from the mapping.
-    """
-    df = df_years_fuels.reindex(index=YEARS, columns=FUEL_ROWS, fill_value=0.0)
-    fuel_cols = [c for c in df.columns if c.strip().lower() not in ("total (%)", "total")]
-    out = {}
-    for year in YEARS:
-        shares = {}
-        for fuel_col in fuel_cols:
-            key = fuel_col.lower().replace("(%)", "").strip()
-            shares[key] = float(df.loc[year, fuel_col])
-        out[int(year)] = shares
-    return out
+@st.cache_data(show_spinner=False, max_entries=8)
+def build_transport_fuel_share(df_fuels_years: pd.DataFrame) -> dict:
+    """
+    Convert fuels×years (% rows) into {year: {fuel_key: float}}
+    Drops the 'Total (%)' row from the mapping.
+    Raises ValueError if a cell is empty (NaN) or infinite.
+    """
+    arr = df_fuels_years.reindex(index=FUEL_COLS, columns=YEARS, fill_value=0.0).to_numpy(dtype=np.float64)
+    if not np.isfinite(arr).all():
+        raise ValueError("Fuel mix contains empty or non-finite cells; fill in every value before running.")
+    # tolist() converts the whole buffer to Python floats in C; no per-value float()
+    return {int(y): dict(zip(FUEL_KEYS, col)) for y, col in zip(YEARS, arr.T.tolist())}
 
+@st.cache_data(show_spinner=False, max_entries=8)
 def build_transport_activity(km_wide_df: pd.DataFrame) -> dict:
     """
     Convert 1×YEARS wide table into {year: float}
+    Raises ValueError if a cell is empty (NaN) or infinite.
     """
-    df = km_wide_df.reindex(columns=YEARS).iloc[0]
-    return {int(y): float(df[y]) for y in YEARS}
+    if tuple(km_wide_df.columns) != YEARS:
+        km_wide_df = km_wide_df.reindex(columns=YEARS)
+    arr = km_wide_df.iloc[0].to_numpy(dtype=np.float64)
+    if not np.isfinite(arr).all():
+        raise ValueError("Transport km contains empty or non-finite cells; fill in every value before running.")
+    vals = arr.tolist()
+    return dict(zip(map(int, YEARS), vals))
+
+# --------------------------------
+# Display helpers
+# --------------------------------
+@st.cache_data(show_spinner=False, max_entries=64)
+def fuel_table_with_totals(fuel_wide: pd.DataFrame) -> pd.DataFrame:
+    """
+    fuels×years table with a 'Total (%)' row appended (column sums).
+    Cached on the frame's contents, so reruns without an edit reuse it. The cache
+    is shared by all sessions, so it is capped with max_entries.
+    """
+    if tuple(fuel_wide.columns) != YEARS:
+        fuel_wide = fuel_wide.reindex(columns=YEARS)
+    n = len(fuel_wide.index)
+    out = np.empty((n + 1, len(YEARS)), dtype=np.float64)
+    out[:n] = fuel_wide.to_numpy(dtype=np.float64)
+    # nansum, like DataFrame.sum: a cleared cell doesn't blank the year's total
+    np.nansum(out[:n], axis=0, out=out[n])
+    return pd.DataFrame(out, index=[*fuel_wide.index, "Total (%)"], columns=YEARS)
 
 # --------------------------------
 # App
@@ -149,10 +335,7 @@ with tab_main:
     with col1:
         st.selectbox(
             "Country",
-            options=[
-                "Australia", "China", "EU-27", "United States",
-                "India", "Japan", "Brazil", "South Africa"
-            ],
+            options=COUNTRIES,
             key="country",
         )
     with col2:
@@ -197,6 +380,13 @@ with tab_main:
             except requests.RequestException as e:
                 st.error(f"Request failed: {e}")
 
+    if st.button("Run all health checks"):
+        for label, result in call_backend_health_checks().items():
+            if isinstance(result, Exception):
+                st.error(f"{label} failed: {result}")
+            else:
+                st.success(f"{label}: {result}")
+
     st.divider()
 
     # --- Legacy run toggle ---
@@ -204,18 +394,20 @@ with tab_main:
 
     if st.button("Run model"):
         if use_legacy:
-            # Build legacy payload and call /v1/run (POST)
-            transport_fuel_share = build_transport_fuel_share(st.session_state["transport_df"])
-            transport_activity = build_transport_activity(st.session_state["transport_km_wide"])
-            payload = {
-                "country": st.session_state["country"],
-                "scenario": st.session_state["scenario"],
-                "transport_fuel_share": transport_fuel_share,
-                "transport_activity": transport_activity,
-                "other_inputs": {"carbon_budget": st.session_state.get("carbon_budget")},
-            }
+            # Build legacy payload and call /v1/run (POST).
+            # Building is inside the try: the builders raise ValueError on empty cells.
             try:
-                resp = call_backend_legacy_run(payload)
+                transport_fuel_share = build_transport_fuel_share(st.session_state["transport_df"])
+                transport_activity = build_transport_activity(st.session_state["transport_km_wide"])
+                payload = {
+                    "country": st.session_state["country"],
+                    "scenario": st.session_state["scenario"],
+                    "transport_fuel_share": transport_fuel_share,
+                    "transport_activity": transport_activity,
+                    "other_inputs": {"carbon_budget": st.session_state.get("carbon_budget")},
+                }
+                with st.spinner("Running model..."):
+                    resp = call_backend_legacy_run(payload)
                 st.success("Legacy backend call OK")
                 st.write(resp)
             except requests.HTTPError as e:
@@ -225,7 +417,8 @@ with tab_main:
         else:
             # With the simplified backend, just hit /v1/hello and display the string
             try:
-                txt = call_backend_hello()
+                with st.spinner("Running model..."):
+                    txt = call_backend_hello()
                 st.success("Simplified backend call OK")
                 st.code(txt, language="text")
             except requests.RequestException as e:
@@ -241,18 +434,17 @@ with tab_transport:
     st.markdown("#### Table 1 — Transport km (% of 2020), by year (2020–2050, 5-year steps)")
     st.caption("Edit values directly. 100 = same as 2020; 120 = 20% higher than 2020.")
 
-    km_wide = st.session_state["transport_km_wide"].reindex(columns=YEARS)
     km_edited = st.data_editor(
-        km_wide,
+        st.session_state["transport_km_wide"],  # already in YEARS order (init_state)
         use_container_width=True,
         num_rows="fixed",
-        column_config={
-            str(y): st.column_config.NumberColumn(str(y), min_value=0.0, max_value=10000.0, step=1.0)
-            for y in YEARS
-        },
+        column_config=_km_col_config(),
         key="km_editor",
     )
-    st.session_state["transport_km_wide"] = km_edited.reindex(columns=YEARS)
+    # The editor is num_rows="fixed" and keeps column order; reindex only if it didn't
+    if tuple(km_edited.columns) != YEARS:
+        km_edited = km_edited.reindex(columns=YEARS)
+    st.session_state["transport_km_wide"] = km_edited
 
     st.divider()
 
@@ -260,31 +452,24 @@ with tab_transport:
     st.markdown("#### Table 2 — Fuel mix by year")
     st.caption("Enter shares for gasoline, diesel, electric, and biofuel. The last row shows the simple sum (Total %).")
 
-    df_years_fuels = st.session_state["transport_df"].reindex(index=YEARS, columns=FUEL_ROWS)
-    fuel_wide = df_years_fuels.T  # rows=fuel, cols=years
-
     edited_wide = st.data_editor(
-        fuel_wide,
+        st.session_state["transport_df"],  # rows=fuel, cols=years
         use_container_width=True,
         num_rows="fixed",
-        column_config={
-            str(y): st.column_config.NumberColumn(str(y), min_value=0.0, max_value=100.0, step=0.1)
-            for y in YEARS
-        },
+        column_config=_fuel_col_config(),
         key="fuel_editor",
     )
 
-    edited_years_fuels = edited_wide.T.reindex(columns=FUEL_ROWS)
-    edited_years_fuels.index.name = "Year"
-    st.session_state["transport_df"] = edited_years_fuels
+    # num_rows="fixed" keeps every fuel row, so at most a plain row select is needed
+    if tuple(edited_wide.index) != FUEL_ROWS:
+        edited_wide = edited_wide.loc[list(FUEL_ROWS)]
+    st.session_state["transport_df"] = edited_wide
 
     # Append "Total (%)" as sum across fuels
-    totals_series = edited_wide.sum(axis=0)
-    totals_row = pd.DataFrame([totals_series.values], index=["Total (%)"], columns=edited_wide.columns)
-    table2_with_totals = pd.concat([edited_wide, totals_row], axis=0).reindex(columns=YEARS)
+    table2_with_totals = fuel_table_with_totals(edited_wide)
 
     st.markdown("##### Table 2 — Fuel mix with Total (%)")
-    st.dataframe(table2_with_totals, use_container_width=True)
+    st.dataframe(table2_with_totals, use_container_width=True, column_order=YEAR_STRS)
 
 # =============================
 # Tab 3 — Outputs
@@ -299,14 +484,11 @@ with tab_outputs:
 
     st.divider()
     st.markdown("#### Transport km (% of 2020)")
-    st.dataframe(st.session_state["transport_km_wide"].reindex(columns=YEARS), use_container_width=True)
+    st.dataframe(st.session_state["transport_km_wide"], use_container_width=True, column_order=YEAR_STRS)
 
     st.markdown("#### Fuel mix (years as columns) with totals")
-    df_years_fuels = st.session_state["transport_df"].reindex(index=YEARS, columns=FUEL_ROWS)
-    fuel_wide_out = df_years_fuels.T
-    totals_out = pd.DataFrame(
-        [fuel_wide_out.sum(axis=0).values],
-        columns=fuel_wide_out.columns,
-        index=["Total (%)"]
+    st.dataframe(
+        fuel_table_with_totals(st.session_state["transport_df"]),
+        use_container_width=True,
+        column_order=YEAR_STRS,
     )
-    st.dataframe(pd.concat([fuel_wide_out, totals_out], axis=0).reindex(columns=YEARS), use_container_width=True)